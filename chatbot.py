@@ -1,6 +1,17 @@
+import asyncio
+import hashlib
+import json
 import os
 import shutil
+import threading
+from collections import OrderedDict
+from typing import List
+from uuid import uuid4
+import faiss
+import numpy as np
 from dotenv import load_dotenv
+from pydantic import PrivateAttr
+from semantic_text_splitter import TextSplitter
 from langchain.document_loaders import (
     DirectoryLoader,
     PyPDFLoader,
@@ -8,25 +19,129 @@ from langchain.document_loaders import (
     UnstructuredWordDocumentLoader,
     CSVLoader,
 )
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
-from langchain.vectorstores import Chroma
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain.chat_models import ChatOpenAI
 from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
+from langchain.memory import ConversationTokenBufferMemory
+from langchain.schema import Document
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from src.parallel import map_files
 
 # Load environment variables
 load_dotenv()
 
+# Chunks per embeddings request and number of requests in flight at once
+EMBED_BATCH_SIZE = 256
+EMBED_CONCURRENCY = 8
+
+# Directory holding the saved FAISS index, and the manifest next to it
+# recording which files (by size and mtime) the index holds chunks of
+FAISS_INDEX_DIR = "db_faiss"
+MANIFEST_PATH = os.path.join(FAISS_INDEX_DIR, "manifest.json")
+
+# Directory holding cached chunk embeddings, keyed by SHA-256 of the text
+EMBEDDING_CACHE_DIR = "emb_cache"
+
+# Cosine similarity above which a previous answer is reused for a query,
+# and the number of answers kept before the oldest is evicted
+QUERY_CACHE_THRESHOLD = 0.92
+QUERY_CACHE_SIZE = 4096
+
+# Number of query embeddings memoized per process
+QUERY_EMBEDDING_CACHE_SIZE = 2048
+
+# I/O-bound formats loaded on DirectoryLoader's thread pool; everything
+# else goes through _load_one on map_files' process pool
+THREADED_LOADERS = {"txt": TextLoader, "csv": CSVLoader}
+
+
+class CachedQueryEmbeddings(OpenAIEmbeddings):
+    """
+    OpenAIEmbeddings that memoizes embed_query in a per-instance LRU cache
+    """
+
+    _query_cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _query_cache_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = hashlib.sha256(text.strip().lower().encode()).digest()
+        with self._query_cache_lock:
+            cached = self._query_cache.get(key)
+            if cached is not None:
+                self._query_cache.move_to_end(key)
+                return list(cached)
+
+        embedding = super().embed_query(text)
+
+        with self._query_cache_lock:
+            self._query_cache[key] = tuple(embedding)
+            if len(self._query_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return embedding
+
+
+def _load_one(file_path: str) -> List[Document]:
+    """
+    Load a single file with the loader matching its extension
+    """
+    filename = os.path.basename(file_path)
+
+    try:
+        # Choose appropriate loader based on file extension
+        if filename.endswith(".pdf"):
+            loader = PyPDFLoader(file_path)
+        elif filename.endswith(".txt"):
+            loader = TextLoader(file_path)
+        elif filename.endswith(".docx"):
+            loader = UnstructuredWordDocumentLoader(file_path)
+        elif filename.endswith(".csv"):
+            loader = CSVLoader(file_path)
+        else:
+            print(f"Unsupported file type: {filename}")
+            return []
+
+        return loader.load()
+    except Exception as e:
+        print(f"Error loading {filename}: {str(e)}")
+        return []
+
 
 class DocumentChatbot:
     def __init__(self, documents_dir="documents/"):
         self.documents_dir = documents_dir
         # Create documents directory if it doesn't exist
         os.makedirs(self.documents_dir, exist_ok=True)
-        self.embeddings = OpenAIEmbeddings()
+        # Cache document embeddings on disk so unchanged chunks are never
+        # re-sent to OpenAI; the model name namespaces the cache
+        openai_embeddings = CachedQueryEmbeddings(
+            chunk_size=EMBED_BATCH_SIZE, max_retries=6
+        )
+        self.embeddings = CacheBackedEmbeddings.from_bytes_store(
+            openai_embeddings,
+            LocalFileStore(EMBEDDING_CACHE_DIR),
+            namespace=openai_embeddings.model,
+            key_encoder="sha256",
+        )
+        self._splitter = TextSplitter(capacity=1000, overlap=200)
+        self._directory_loaders = [
+            DirectoryLoader(
+                self.documents_dir,
+                glob=f"*.{ext}",
+                loader_cls=loader_cls,
+                use_multithreading=True,
+                max_concurrency=os.cpu_count(),
+                silent_errors=True,
+            )
+            for ext, loader_cls in THREADED_LOADERS.items()
+        ]
+        self.vectorstore = None
+        self._reset_query_cache()
         self.setup_vectorstore()
-        self.setup_chain()
+        if self.vectorstore is not None:
+            self.setup_chain()
 
     def upload_document(self, file_path: str) -> bool:
         """
@@ -40,84 +155,257 @@ class DocumentChatbot:
             destination = os.path.join(self.documents_dir, filename)
             shutil.copy2(file_path, destination)
 
-            # Reload vector store with new document
-            self.setup_vectorstore()
+            # Embed only the new document's chunks into the existing index,
+            # replacing those of an earlier upload with the same name
+            self._drop_sources([destination])
+            self._ingest(self._load_and_split(destination))
+            if self.vectorstore is None:
+                return False
+            self._record_sources([destination])
+            self._save_index()
+
+            # Cached answers may be stale now that the corpus has changed
+            self._reset_query_cache()
+
+            # The retriever shares the vector store, so the chain only needs
+            # building the first time a document is indexed
+            if not hasattr(self, "chain"):
+                self.setup_chain()
             return True
         except Exception as e:
             print(f"Error uploading document: {str(e)}")
             return False
 
+    def _load_and_split(self, file_path: str) -> List[Document]:
+        """
+        Load a single file and split it into chunks
+        """
+        return self._split(_load_one(file_path))
+
+    def _split(self, documents: List[Document]) -> List[Document]:
+        """
+        Split documents into chunks, keeping each document's metadata
+        """
+        return [
+            Document(page_content=chunk, metadata=dict(doc.metadata))
+            for doc in documents
+            for chunk in self._splitter.chunks(doc.page_content)
+        ]
+
+    def _ingest(self, splits: List[Document]):
+        """
+        Embed chunks and add them to the vector store, creating it on first use
+        """
+        if not splits:
+            return
+
+        texts = [doc.page_content for doc in splits]
+        metadatas = [doc.metadata for doc in splits]
+        embeddings = asyncio.run(self._embed_batches(texts))
+        text_embeddings = list(zip(texts, embeddings))
+        ids = [uuid4().hex for _ in texts]
+        # Remember which vectors came from which file, so they can be
+        # dropped when the file changes or goes away
+        for doc, doc_id in zip(splits, ids):
+            source = os.path.normpath(doc.metadata.get("source", ""))
+            self._manifest.setdefault(source, {"ids": []})["ids"].append(doc_id)
+
+        # Insert pre-computed vectors so the store doesn't embed again.
+        # OpenAI embeddings are unit length, so inner product is cosine.
+        if self.vectorstore is None:
+            self.vectorstore = FAISS.from_embeddings(
+                text_embeddings,
+                self.embeddings,
+                metadatas=metadatas,
+                ids=ids,
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+            )
+        else:
+            self.vectorstore.add_embeddings(
+                text_embeddings, metadatas=metadatas, ids=ids
+            )
+
+    async def _embed_batches(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts in fixed-size batches with a bounded number of concurrent requests
+        """
+        semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+        async def embed(batch):
+            async with semaphore:
+                return await self.embeddings.aembed_documents(batch)
+
+        batches = [
+            texts[i : i + EMBED_BATCH_SIZE]
+            for i in range(0, len(texts), EMBED_BATCH_SIZE)
+        ]
+        results = await asyncio.gather(*(embed(batch) for batch in batches))
+        return [vector for result in results for vector in result]
+
+    def _scan_documents(self) -> dict:
+        """
+        Map each file in the documents directory to its (size, mtime)
+        """
+        files = {}
+        with os.scandir(self.documents_dir) as it:
+            for entry in it:
+                if entry.is_file():
+                    stat = entry.stat()
+                    files[os.path.normpath(entry.path)] = [stat.st_size, stat.st_mtime_ns]
+        return files
+
+    def _drop_sources(self, paths: List[str]):
+        """
+        Remove the vectors of the given files from the index and manifest
+        """
+        ids = []
+        for path in paths:
+            ids.extend(self._manifest.pop(os.path.normpath(path), {}).get("ids", []))
+        if ids and self.vectorstore is not None:
+            self.vectorstore.delete(ids)
+
+    def _record_sources(self, paths: List[str]):
+        """
+        Store the current size and mtime of freshly ingested files
+        """
+        files = self._scan_documents()
+        for path in map(os.path.normpath, paths):
+            if path in files:
+                self._manifest.setdefault(path, {"ids": []})["signature"] = files[path]
+
+    def _save_index(self):
+        """
+        Save the FAISS index together with its manifest
+        """
+        self.vectorstore.save_local(FAISS_INDEX_DIR)
+        with open(MANIFEST_PATH, "w") as f:
+            json.dump(self._manifest, f)
+
     def setup_vectorstore(self):
         """
         Setup vector store with support for multiple file types
         """
+        self._manifest = {}
+        # Reuse the saved index rather than re-embedding the whole corpus,
+        # as long as its manifest says which files it was built from
+        if os.path.exists(FAISS_INDEX_DIR) and os.path.exists(MANIFEST_PATH):
+            self.vectorstore = FAISS.load_local(
+                FAISS_INDEX_DIR,
+                self.embeddings,
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+                allow_dangerous_deserialization=True,
+            )
+            with open(MANIFEST_PATH) as f:
+                self._manifest = json.load(f)
+
+            # Re-embed only files added or changed since the index was
+            # saved, and drop the vectors of changed and removed files
+            files = self._scan_documents()
+            stale = [
+                path
+                for path, entry in self._manifest.items()
+                if files.get(path) != entry.get("signature")
+            ]
+            changed = [
+                path
+                for path, signature in files.items()
+                if self._manifest.get(path, {}).get("signature") != signature
+            ]
+            if not stale and not changed:
+                return
+            self._drop_sources(stale)
+            documents = []
+            for docs in map_files(_load_one, changed):
+                documents.extend(docs)
+            self._ingest(self._split(documents))
+            self._record_sources(changed)
+            self._save_index()
+            return
+
         documents = []
+        for loader in self._directory_loaders:
+            documents.extend(loader.load())
 
-        # Process each file in the documents directory
-        for filename in os.listdir(self.documents_dir):
-            file_path = os.path.join(self.documents_dir, filename)
-
-            try:
-                # Choose appropriate loader based on file extension
-                if filename.endswith(".pdf"):
-                    loader = PyPDFLoader(file_path)
-                elif filename.endswith(".txt"):
-                    loader = TextLoader(file_path)
-                elif filename.endswith(".docx"):
-                    loader = UnstructuredWordDocumentLoader(file_path)
-                elif filename.endswith(".csv"):
-                    loader = CSVLoader(file_path)
-                else:
-                    print(f"Unsupported file type: {filename}")
-                    continue
+        threaded_suffixes = tuple(f".{ext}" for ext in THREADED_LOADERS)
+        paths = [
+            os.path.join(self.documents_dir, filename)
+            for filename in os.listdir(self.documents_dir)
+            if not filename.endswith(threaded_suffixes)
+        ]
 
-                # Load documents
-                documents.extend(loader.load())
+        for docs in map_files(_load_one, paths):
+            documents.extend(docs)
 
-            except Exception as e:
-                print(f"Error loading {filename}: {str(e)}")
-                continue
+        splits = self._split(documents)
 
-        if not documents:
+        if not splits:
             print(
                 "No documents loaded. Please add documents to the documents directory."
             )
             return
 
-        # Split documents into chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=200, length_function=len
-        )
-        splits = text_splitter.split_documents(documents)
-
-        # Create vector store
-        self.vectorstore = Chroma.from_documents(
-            documents=splits, embedding=self.embeddings, persist_directory="db"
-        )
+        self._ingest(splits)
+        self._record_sources(self._scan_documents())
+        self._save_index()
 
     def setup_chain(self):
         # Initialize language model
         # llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
         llm = ChatOpenAI(model_name="gpt-4o", temperature=0)
 
-        # Setup memory
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history", return_messages=True
+        # Setup memory, keeping only as much recent history as fits the budget
+        self.memory = ConversationTokenBufferMemory(
+            llm=llm,
+            memory_key="chat_history",
+            return_messages=True,
+            output_key="answer",
+            max_token_limit=2000,
         )
 
+        # Build the retriever once; it shares the vector store, so later
+        # ingests are visible without rebuilding it
+        self.retriever = self.vectorstore.as_retriever(search_kwargs={"k": 4})
+
         # Create conversation chain
         self.chain = ConversationalRetrievalChain.from_llm(
             llm=llm,
-            retriever=self.vectorstore.as_retriever(),
+            retriever=self.retriever,
             memory=self.memory,
             return_source_documents=True,
         )
 
+    def _reset_query_cache(self):
+        """
+        Drop all cached (query embedding -> answer) pairs
+        """
+        self._qcache_index = None
+        self._qcache_answers = []
+
     def chat(self, query: str) -> str:
         """
         Process a user query and return the response
         """
+        query_vector = np.array(self.embeddings.embed_query(query), dtype="float32")
+        query_vector /= np.linalg.norm(query_vector)
+
+        # Serve paraphrases of recent questions from the semantic cache
+        if self._qcache_index is not None and self._qcache_index.ntotal > 0:
+            scores, indices = self._qcache_index.search(query_vector[None], 1)
+            if scores[0, 0] >= QUERY_CACHE_THRESHOLD:
+                answer = self._qcache_answers[indices[0, 0]]
+                self.memory.save_context({"question": query}, {"answer": answer})
+                return answer
+
         result = self.chain({"question": query})
+
+        if self._qcache_index is None:
+            self._qcache_index = faiss.IndexFlatIP(len(query_vector))
+        if self._qcache_index.ntotal >= QUERY_CACHE_SIZE:
+            self._qcache_index.remove_ids(np.array([0], dtype="int64"))
+            self._qcache_answers.pop(0)
+        self._qcache_index.add(query_vector[None])
+        self._qcache_answers.append(result["answer"])
+
         return result["answer"]
 
 
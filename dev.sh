@@ -1,4 +1,8 @@
 #!/bin/bash
+# Redis counts failed logins for account lockout; it is optional, and
+# logins keep working without lockout when it is unreachable
+export REDIS_URL="${REDIS_URL:-redis://localhost:6379/0}"
+
 # Start the FastAPI backend in development mode
 uvicorn src.api:app --reload --port 8000 &
 
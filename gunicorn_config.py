@@ -1,12 +1,14 @@
 # Gunicorn configuration file
 import multiprocessing
+import os
 
 # Server socket
 bind = "0.0.0.0:8000"
 backlog = 2048
 
 # Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
+# Each worker holds its own chatbot and index, so default to one per core
+workers = int(os.getenv("WEB_CONCURRENCY", max(2, multiprocessing.cpu_count())))
 worker_class = "uvicorn.workers.UvicornWorker"
 worker_connections = 1000
 timeout = 300
@@ -20,12 +22,14 @@ accesslog = "-"
 errorlog = "-"
 loglevel = "info"
 
-# Restart workers when code changes
-reload = True
+# Restart workers when code changes (development only)
+reload = os.getenv("ENV", "prod") == "dev"
 
 # Maximum requests a worker will process before restarting
 max_requests = 1000
 max_requests_jitter = 50
 
 # Process management
+# Import the app before forking so library code pages are shared
+# copy-on-write; the chatbot itself is still built per worker on startup
 preload_app = True
@@ -1,4 +1,8 @@
 import os
+import asyncio
+import logging
+import aiofiles
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
@@ -8,8 +12,20 @@ from src.chatbot import DocumentChatbot
 # Load environment variables
 load_dotenv()
 
+logging.basicConfig(level=os.getenv("LOGLEVEL", "WARNING"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the chatbot off the event loop so /health is served immediately
+    app.state.chatbot_task = asyncio.create_task(
+        asyncio.to_thread(initialize_chatbot)
+    )
+    yield
+
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware with more permissive settings
 app.add_middleware(
@@ -37,10 +53,6 @@ def initialize_chatbot():
         print(f"Error initializing chatbot: {str(e)}")
 
 
-# Initialize on startup
-initialize_chatbot()
-
-
 class ChatMessage(BaseModel):
     message: str
 
@@ -50,6 +62,8 @@ async def chat(message: ChatMessage):
     print(f"Received chat request with message: {message.message}")
     global chatbot
     try:
+        # Wait for startup initialization before falling back to a retry
+        await app.state.chatbot_task
         if chatbot is None:
             print("Chatbot not initialized, attempting to initialize...")
             initialize_chatbot()
@@ -85,12 +99,23 @@ async def upload_document(file: UploadFile = File(...)):
         # Create documents directory if it doesn't exist
         os.makedirs("documents", exist_ok=True)
 
-        # Save the uploaded file
+        # Stream the uploaded file to disk in chunks, enforcing the 50MB limit
         file_path = os.path.join("documents", file.filename)
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-
+        file_size = 0
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk := await file.read(1024 * 1024):
+                file_size += len(chunk)
+                if file_size > 50 * 1024 * 1024:
+                    break
+                await buffer.write(chunk)
+
+        if file_size > 50 * 1024 * 1024:
+            os.remove(file_path)
+            raise HTTPException(
+                status_code=413, detail="File too large. Maximum size is 50MB."
+            )
+
+        await app.state.chatbot_task
         if chatbot is None:
             initialize_chatbot()
 
@@ -102,6 +127,8 @@ async def upload_document(file: UploadFile = File(...)):
         else:
             print(f"Failed to process document: {file.filename}")
             raise HTTPException(status_code=400, detail="Failed to process document")
+    except HTTPException as he:
+        raise he
     except Exception as e:
         print(f"Error in upload endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
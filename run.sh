@@ -7,6 +7,10 @@ pkill -f "node.*react-scripts start"
 lsof -ti:8000 | xargs kill -9 2>/dev/null || true
 sleep 2  # Give processes time to shut down
 
+# Redis counts failed logins for account lockout; it is optional, and
+# logins keep working without lockout when it is unreachable
+export REDIS_URL="${REDIS_URL:-redis://localhost:6379/0}"
+
 # Start the FastAPI backend
 gunicorn src.api:app -c gunicorn_config.py &
 
@@ -8,7 +8,9 @@ from fastapi import (
     BackgroundTasks,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, EmailStr, constr
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
@@ -17,11 +19,27 @@ from typing import Optional
 from sqlalchemy.orm import Session
 import shutil
 import os
+import asyncio
+import json
 import secrets
 import time
 from .chatbot import DocumentChatbot
 from .database import get_db, DBUser
-import uuid
+from .documents_index import (
+    DOCUMENTS_DIR,
+    Document,
+    index_document,
+    list_indexed_documents,
+    pop_indexed_document,
+    unindex_document,
+)
+import logging
+import aiofiles
+from redis import asyncio as redis
+from redis.exceptions import RedisError
+
+logging.basicConfig(level=os.getenv("LOGLEVEL", "WARNING"))
+logger = logging.getLogger(__name__)
 
 # Security Configuration
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-keep-it-secret")
@@ -32,11 +50,42 @@ PASSWORD_RESET_TOKEN_EXPIRE_MINUTES = 15
 MAX_LOGIN_ATTEMPTS = 5
 LOGIN_COOLDOWN_MINUTES = 15
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing: new hashes use argon2, existing bcrypt hashes still
+# verify and are upgraded on the next successful login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__time_cost=int(os.getenv("ARGON2_TIME_COST", "2")),
+    argon2__memory_cost=int(os.getenv("ARGON2_MEMORY_COST", "65536")),
+    # Fixed rather than the core count: needs_update() compares parallelism,
+    # so a host-dependent value would rehash every login on a different host
+    argon2__parallelism=int(os.getenv("ARGON2_PARALLELISM", "2")),
+    bcrypt__rounds=int(os.getenv("BCRYPT_ROUNDS", "12")),
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-app = FastAPI()
+# Ephemeral counters such as failed login attempts. Redis is optional:
+# without it logins still work, just without lockout after failed attempts
+redis_client = redis.from_url(
+    os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+    decode_responses=True,
+    socket_connect_timeout=1,
+    socket_timeout=1,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the chatbot off the event loop so /health is served immediately
+    app.state.chatbot_task = asyncio.create_task(
+        asyncio.to_thread(initialize_chatbot)
+    )
+    # Serializes background ingests into the shared vector store
+    app.state.ingest_lock = asyncio.Lock()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -97,14 +146,6 @@ class PasswordResetConfirm(BaseModel):
     new_password: constr(min_length=8)
 
 
-# Document Models
-class Document(BaseModel):
-    id: str
-    filename: str
-    uploaded_at: datetime
-    user_id: str
-
-
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -113,6 +154,15 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+# bcrypt is slow and CPU-bound, so async handlers run it in a worker thread
+async def verify_password_async(plain_password, hashed_password):
+    return await asyncio.to_thread(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password):
+    return await asyncio.to_thread(get_password_hash, password)
+
+
 def get_user(db: Session, username: str):
     return db.query(DBUser).filter(DBUser.username == username).first()
 
@@ -121,39 +171,54 @@ def get_user_by_email(db: Session, email: str):
     return db.query(DBUser).filter(DBUser.email == email).first()
 
 
-def authenticate_user(db: Session, username: str, password: str):
+async def authenticate_user(db: Session, username: str, password: str):
     user = get_user(db, username)
     if not user:
         return False
 
+    # Failed attempts are counted in Redis and expire after the cooldown
+    failed_key = f"faillog:{username}"
+
     # Check for account lockout
-    if user.failed_login_attempts >= MAX_LOGIN_ATTEMPTS:
-        if user.last_failed_login:
-            lockout_time = datetime.fromtimestamp(user.last_failed_login) + timedelta(
-                minutes=LOGIN_COOLDOWN_MINUTES
-            )
-            if datetime.now() < lockout_time:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail=f"Account locked. Try again after {lockout_time}",
-                )
-            # Reset counter after cooldown
-            user.failed_login_attempts = 0
-            db.commit()
-
-    if not verify_password(password, user.hashed_password):
+    try:
+        failed_attempts = int(await redis_client.get(failed_key) or 0)
+        if failed_attempts >= MAX_LOGIN_ATTEMPTS:
+            ttl = await redis_client.ttl(failed_key)
+    except RedisError:
+        logger.warning("Redis unavailable, skipping login lockout check", exc_info=True)
+        failed_attempts = 0
+    if failed_attempts >= MAX_LOGIN_ATTEMPTS:
+        lockout_time = datetime.now() + timedelta(seconds=max(ttl, 0))
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Account locked. Try again after {lockout_time}",
+        )
+
+    if not await verify_password_async(password, user.hashed_password):
         # Increment failed login attempts
-        user.failed_login_attempts += 1
-        user.last_failed_login = datetime.now().timestamp()
-        db.commit()
+        try:
+            await (
+                redis_client.pipeline()
+                .incr(failed_key)
+                .expire(failed_key, LOGIN_COOLDOWN_MINUTES * 60)
+                .execute()
+            )
+        except RedisError:
+            logger.warning("Redis unavailable, failed login not counted", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect password"
         )
 
+    # Upgrade hashes made with a deprecated scheme or old parameters
+    if pwd_context.needs_update(user.hashed_password):
+        user.hashed_password = await get_password_hash_async(password)
+        db.commit()
+
     # Reset failed login attempts on successful login
-    user.failed_login_attempts = 0
-    user.last_failed_login = None
-    db.commit()
+    try:
+        await redis_client.delete(failed_key)
+    except RedisError:
+        logger.warning("Redis unavailable, failed logins not reset", exc_info=True)
     return user
 
 
@@ -217,7 +282,6 @@ def initialize_chatbot():
                 return None
             
             print(f"Found {len(documents)} documents")
-            chatbot.setup_chain()
             print("Chatbot initialized successfully")
             return chatbot
     except Exception as e:
@@ -230,16 +294,12 @@ def initialize_chatbot():
         )
 
 
-# Initialize on startup
-initialize_chatbot()
-
-
 # Authentication endpoints
 @app.post("/token", response_model=Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
 ):
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -306,7 +366,7 @@ async def register_user(user: UserCreate, db: Session = Depends(get_db)):
         )
 
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     db_user = DBUser(
         username=user.username, email=user.email, hashed_password=hashed_password
     )
@@ -394,7 +454,7 @@ async def confirm_password_reset(
         raise HTTPException(status_code=400, detail="Reset token has expired")
 
     # Update password
-    user.hashed_password = get_password_hash(reset_confirm.new_password)
+    user.hashed_password = await get_password_hash_async(reset_confirm.new_password)
     user.reset_token = None
     user.reset_token_expires = None
     db.commit()
@@ -416,11 +476,13 @@ async def update_user(
         current_user.email = user_update.email
 
     if user_update.current_password and user_update.new_password:
-        if not verify_password(
+        if not await verify_password_async(
             user_update.current_password, current_user.hashed_password
         ):
             raise HTTPException(status_code=400, detail="Incorrect current password")
-        current_user.hashed_password = get_password_hash(user_update.new_password)
+        current_user.hashed_password = await get_password_hash_async(
+            user_update.new_password
+        )
 
     db.commit()
     db.refresh(current_user)
@@ -445,43 +507,52 @@ async def upload_file(
         # Create documents directory if it doesn't exist
         os.makedirs("documents", exist_ok=True)
 
-        # Check file size (limit to 50MB)
+        # Stream the upload to disk in chunks, enforcing the 50MB limit
+        file_path = os.path.join("documents", file.filename)
         file_size = 0
-        content = bytearray()
-
-        # Read file in chunks to check size
         chunk_size = 1024 * 1024  # 1MB chunks
-        while True:
-            chunk = await file.read(chunk_size)
-            if not chunk:
-                break
-            file_size += len(chunk)
-            content.extend(chunk)
-
-            # Check if file is too large (50MB limit)
-            if file_size > 50 * 1024 * 1024:  # 50MB
-                raise HTTPException(
-                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                    detail="File too large. Maximum size is 50MB.",
-                )
-
-        # Save the uploaded file
-        file_path = os.path.join("documents", file.filename)
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk := await file.read(chunk_size):
+                file_size += len(chunk)
 
-        # Initialize new chatbot instance in the background
-        def init_chatbot():
+                # Check if file is too large (50MB limit)
+                if file_size > 50 * 1024 * 1024:  # 50MB
+                    break
+                await buffer.write(chunk)
+
+        if file_size > 50 * 1024 * 1024:
+            os.remove(file_path)
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="File too large. Maximum size is 50MB.",
+            )
+
+        await asyncio.to_thread(index_document, file.filename, current_user.username)
+
+        # Index only the new file in the background; chat() searches
+        # the same vector store, so it sees the new chunks immediately
+        def ingest_document():
             global chatbot
-            try:
+            if chatbot is None:
+                # A fresh chatbot loads every file, including this one
                 chatbot = DocumentChatbot()
-                chatbot.setup_chain()
+                return
+            # Drop chunks from an earlier upload with the same name
+            chatbot.vectorstore.delete(where={"source": file_path})
+            chatbot._ingest(chatbot._load_and_split(file_path))
+
+        async def init_chatbot():
+            try:
+                await asyncio.wait([app.state.chatbot_task])
+                async with app.state.ingest_lock:
+                    await asyncio.to_thread(ingest_document)
                 print(f"Successfully processed file: {file.filename}")
             except Exception as e:
                 print(f"Error processing document: {str(e)}")
                 # Delete the file if processing fails
                 try:
                     os.remove(file_path)
+                    await asyncio.to_thread(unindex_document, file.filename)
                 except:
                     pass
                 raise e
@@ -500,32 +571,40 @@ async def upload_file(
         )
 
 
+async def get_ready_chatbot():
+    """Return the initialized chatbot, or raise if there is nothing to chat about"""
+    global chatbot
+    # Check if documents exist
+    if not os.path.exists("documents") or not os.listdir("documents"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Please upload some documents first",
+        )
+
+    # Wait for startup initialization before falling back to a retry
+    await asyncio.wait([app.state.chatbot_task])
+    if chatbot is None:
+        print("Chatbot not initialized, attempting to initialize...")
+        chatbot = await asyncio.to_thread(initialize_chatbot)
+
+    if not hasattr(chatbot, "chat_chain"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Please upload some documents first",
+        )
+    return chatbot
+
+
 @app.post("/chat")
 async def chat(
     message: ChatMessage, current_user: DBUser = Depends(get_current_active_user)
 ):
-    global chatbot
     print(f"Received chat request with message: {message.message}")
     try:
-        # Check if documents exist
-        if not os.path.exists("documents") or not os.listdir("documents"):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Please upload some documents first",
-            )
-
-        if chatbot is None:
-            print("Chatbot not initialized, attempting to initialize...")
-            chatbot = initialize_chatbot()
-
-        if not hasattr(chatbot, "chain"):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Please upload some documents first",
-            )
+        ready_chatbot = await get_ready_chatbot()
 
         print("Processing message with chatbot...")
-        response = chatbot.chat(message.message)
+        response = await asyncio.to_thread(ready_chatbot.chat, message.message)
         print(f"Got response from chatbot: {response}")
 
         return {"response": response}
@@ -544,14 +623,45 @@ async def chat(
         )
 
 
+@app.post("/chat/stream")
+async def chat_stream(
+    message: ChatMessage, current_user: DBUser = Depends(get_current_active_user)
+):
+    print(f"Received streaming chat request with message: {message.message}")
+    try:
+        ready_chatbot = await get_ready_chatbot()
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        print(f"Error in chat stream endpoint: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
+        )
+
+    # Server-sent events: one JSON-encoded token per event, then "done"
+    async def event_stream():
+        try:
+            async for token in ready_chatbot.astream_chat(message.message):
+                yield f"data: {json.dumps(token)}\n\n"
+        except Exception as e:
+            print(f"Error in chat stream endpoint: {str(e)}")
+            yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
     try:
         # Check if chatbot is initialized and has documents
         has_documents = os.path.exists("documents") and bool(os.listdir("documents"))
-        if chatbot is None and has_documents:
-            initialize_chatbot()
+        if chatbot is None and has_documents and app.state.chatbot_task.done():
+            # Retry in the background rather than blocking the health check
+            app.state.chatbot_task = asyncio.create_task(
+                asyncio.to_thread(initialize_chatbot)
+            )
         return {
             "status": "healthy",
             "chatbot_initialized": chatbot is not None,
@@ -566,23 +676,7 @@ async def health_check():
 @app.get("/documents", response_model=list[Document])
 async def list_documents(current_user: DBUser = Depends(get_current_active_user)):
     try:
-        documents_dir = "documents"
-        if not os.path.exists(documents_dir):
-            return []
-
-        documents = []
-        for filename in os.listdir(documents_dir):
-            file_path = os.path.join(documents_dir, filename)
-            if os.path.isfile(file_path):
-                doc_id = str(uuid.uuid4())
-                doc = Document(
-                    id=doc_id,
-                    filename=filename,
-                    uploaded_at=datetime.fromtimestamp(os.path.getctime(file_path)),
-                    user_id=current_user.username,
-                )
-                documents.append(doc)
-
+        documents = await asyncio.to_thread(list_indexed_documents)
         return sorted(documents, key=lambda x: x.uploaded_at, reverse=True)
     except Exception as e:
         raise HTTPException(
@@ -595,31 +689,30 @@ async def delete_document(
     document_id: str, current_user: DBUser = Depends(get_current_active_user)
 ):
     try:
-        documents_dir = "documents"
-        deleted = False
-
-        for filename in os.listdir(documents_dir):
-            file_path = os.path.join(documents_dir, filename)
-            if os.path.isfile(file_path):
-                try:
-                    os.remove(file_path)
-                    deleted = True
-                    break
-                except Exception as e:
-                    print(f"Error deleting file {filename}: {str(e)}")
-
-        if deleted:
-            # Reinitialize chatbot after document deletion
-            global chatbot
-            chatbot = None
-            if os.listdir(documents_dir):  # If there are still documents
-                initialize_chatbot()
-
-            return {"message": "Document deleted successfully"}
-        else:
+        doc = await asyncio.to_thread(pop_indexed_document, document_id)
+        if doc is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Document not found"
             )
+
+        file_path = os.path.join(DOCUMENTS_DIR, doc.filename)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+        # Drop only this file's chunks instead of rebuilding the chatbot.
+        # Waiting for the ingest lock means a still-running ingest of this
+        # file finishes first, so its chunks cannot outlive the delete
+        def unindex_chunks():
+            if chatbot is not None and hasattr(chatbot, "vectorstore"):
+                chatbot.vectorstore.delete(where={"source": file_path})
+                chatbot.semantic_cache.clear()
+
+        async with app.state.ingest_lock:
+            await asyncio.to_thread(unindex_chunks)
+
+        return {"message": "Document deleted successfully"}
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
@@ -1,40 +1,151 @@
-import os
+import asyncio
+import threading
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from .semantic_cache import SemanticCache
+from .clients import get_llm
 
 # Load environment variables
 load_dotenv()
 
+# "Stuff" prompt: every retrieved chunk goes into a single system message
+QA_PROMPT = ChatPromptTemplate.from_messages([
+    ("system",
+     "Use the following pieces of context to answer the user's question. "
+     "If you don't know the answer, just say that you don't know, "
+     "don't try to make up an answer.\n----------------\n{context}"),
+    MessagesPlaceholder("chat_history"),
+    ("human", "{question}"),
+])
 
-class ChatChain:
-    def __init__(self, retriever):
-        # Get API key from environment
-        openai_api_key = os.getenv("OPENAI_API_KEY")
-        if not openai_api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-
-        self.llm = ChatOpenAI(
-            model_name="gpt-3.5-turbo", temperature=0, openai_api_key=openai_api_key
-        )
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history", return_messages=True, output_key="answer"
-        )
-        self.chain = self._create_chain(retriever)
+# Rewrites a follow-up into a standalone question before it is embedded, so
+# retrieval and the semantic cache see what the user is actually asking
+CONDENSE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system",
+     "Given the following conversation and a follow up question, rephrase "
+     "the follow up question to be a standalone question, in its original "
+     "language."),
+    MessagesPlaceholder("chat_history"),
+    ("human", "Follow Up Input: {question}\nStandalone question:"),
+])
 
-    def _create_chain(self, retriever):
-        return ConversationalRetrievalChain.from_llm(
+
+class ChatChain:
+    def __init__(self, retriever, embeddings=None, semantic_cache=None):
+        self.llm = get_llm()
+        self.retriever = retriever
+        # Older turns are summarized once the history passes max_token_limit
+        self.memory = ConversationSummaryBufferMemory(
             llm=self.llm,
-            retriever=retriever,
-            memory=self.memory,
-            return_source_documents=True,
+            memory_key="chat_history",
+            return_messages=True,
             output_key="answer",
+            max_token_limit=1024,
         )
+        # Queries run concurrently in worker threads. The lock is held only
+        # to snapshot the history and to save a turn, so a summarizing save
+        # never interleaves with a read; answers are generated outside it
+        self._memory_lock = threading.Lock()
+        self.chain = self._create_chain()
+        self.condense_chain = CONDENSE_PROMPT | self.llm
+
+        # Answers to earlier questions, reused for near-duplicate queries;
+        # only enabled when there are embeddings to compare queries with
+        self.embeddings = embeddings
+        if semantic_cache is None:
+            semantic_cache = SemanticCache(threshold=0.95)
+        self.semantic_cache = semantic_cache
+
+    def _create_chain(self):
+        # Retrieval happens in _retrieve, so the chain only has to
+        # answer from the retrieved chunks; it streams for astream_query
+        return QA_PROMPT | get_llm(streaming=True)
+
+    def _retrieve(self, query, query_embedding=None):
+        """Retrieve context for the query, reusing its embedding if known"""
+        if query_embedding is not None:
+            docs = self.retriever.vectorstore.similarity_search_by_vector(
+                query_embedding, **self.retriever.search_kwargs
+            )
+        else:
+            docs = self.retriever.invoke(query)
+        return "\n\n".join(doc.page_content for doc in docs)
+
+    def _history(self):
+        """Snapshot of the chat history, safe to use after the lock is released"""
+        with self._memory_lock:
+            return list(self.memory.load_memory_variables({})["chat_history"])
+
+    def _save_turn(self, query, answer):
+        """Append a turn to the shared history"""
+        # Saving may summarize older turns with an LLM call
+        with self._memory_lock:
+            self.memory.save_context({"question": query}, {"answer": answer})
 
     def process_query(self, query: str) -> str:
         """
         Process a user query and return the response
         """
-        result = self.chain({"question": query})
-        return result["answer"]
+        history = self._history()
+        question = query
+        if history:
+            question = self.condense_chain.invoke(
+                {"chat_history": history, "question": query}
+            ).content
+
+        query_embedding = None
+        if self.embeddings is not None:
+            query_embedding = self.embeddings.embed_query(question)
+            cached_answer = self.semantic_cache.get(query_embedding)
+            if cached_answer is not None:
+                self._save_turn(query, cached_answer)
+                return cached_answer
+
+        inputs = {
+            "context": self._retrieve(question, query_embedding),
+            "chat_history": history,
+            "question": query,
+        }
+        answer = self.chain.invoke(inputs).content
+        self._save_turn(query, answer)
+        if query_embedding is not None:
+            self.semantic_cache.put(query_embedding, answer, ttl=3600)
+        return answer
+
+    async def astream_query(self, query: str):
+        """
+        Process a user query, yielding the answer token by token
+        """
+        # Memory access goes through threads so the event loop never waits
+        # on the lock while another query's save is summarizing
+        history = await asyncio.to_thread(self._history)
+        question = query
+        if history:
+            condensed = await self.condense_chain.ainvoke(
+                {"chat_history": history, "question": query}
+            )
+            question = condensed.content
+
+        query_embedding = None
+        if self.embeddings is not None:
+            query_embedding = await asyncio.to_thread(self.embeddings.embed_query, question)
+            cached_answer = self.semantic_cache.get(query_embedding)
+            if cached_answer is not None:
+                await asyncio.to_thread(self._save_turn, query, cached_answer)
+                yield cached_answer
+                return
+
+        inputs = {
+            "context": await asyncio.to_thread(self._retrieve, question, query_embedding),
+            "chat_history": history,
+            "question": query,
+        }
+        tokens = []
+        async for chunk in self.chain.astream(inputs):
+            tokens.append(chunk.content)
+            yield chunk.content
+        answer = "".join(tokens)
+        await asyncio.to_thread(self._save_turn, query, answer)
+        if query_embedding is not None:
+            self.semantic_cache.put(query_embedding, answer, ttl=3600)
@@ -1,164 +1,175 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import TextLoader, PDFMinerLoader
+from langchain_community.document_loaders import TextLoader, PyMuPDFLoader
 from langchain_community.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings
-from langchain_openai import ChatOpenAI
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
+import logging
 import os
+import threading
 from dotenv import load_dotenv
-import time
-from langchain.schema import Document
+from .vector_store import add_documents_in_batches, cached_embeddings, chunk_id
+from .semantic_cache import SemanticCache
+from .clients import get_embeddings
+from .parallel import map_files
+from .chat_chain import ChatChain
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+
+# Reusable buffer for PDF header checks, one per thread since ingests run
+# _load_one from worker threads as well as from the process pool
+_header_buf = threading.local()
+
+
+def _read_header(file_path, size=4):
+    """Read the first bytes of a file into this thread's reused buffer"""
+    buf = getattr(_header_buf, "buf", None)
+    if buf is None:
+        buf = _header_buf.buf = bytearray(16)
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        n = os.preadv(fd, [memoryview(buf)[:size]], 0)
+    finally:
+        os.close(fd)
+    return memoryview(buf)[:n]
+
+
+def _load_one(file_path):
+    """Load a single file from the documents directory, skipping it on error"""
+    filename = os.path.basename(file_path)
+    logger.debug("Processing file: %s", file_path)
+    
+    try:
+        if filename.endswith('.pdf'):
+            try:
+                # Verify PDF file header with a single positional read
+                if _read_header(file_path) != b'%PDF':
+                    logger.warning("%s does not appear to be a valid PDF file", filename)
+                    return []
+                
+                # PyMuPDF extracts text in native code, much faster than PDFMiner
+                loader = PyMuPDFLoader(file_path)
+                loaded_docs = loader.load()
+                
+                # Validate content
+                valid_docs = [
+                    doc for doc in loaded_docs
+                    if hasattr(doc, 'page_content') and doc.page_content.strip()
+                ]
+                
+                if valid_docs:
+                    logger.info("Loaded %d pages with content from %s", len(valid_docs), filename)
+                else:
+                    logger.warning("No valid content found in %s", filename)
+                return valid_docs
+                    
+            except Exception:
+                logger.exception("Error loading PDF %s", filename)
+                return []
+        else:
+            loader = TextLoader(file_path)
+            loaded_docs = loader.load()
+            logger.info("Loaded text from %s", filename)
+            return loaded_docs
+    except Exception:
+        logger.exception("Error loading %s", filename)
+        return []
+
+
 class DocumentChatbot:
     def __init__(self, documents_dir="documents/"):
         self.documents_dir = documents_dir
         self.persist_directory = "chroma_db"
-        openai_api_key = os.getenv("OPENAI_API_KEY")
-        if not openai_api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-        self.embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
+        self.embeddings = cached_embeddings(get_embeddings())
+        # Chunk sizes are in tokens of the embedding model, counted by
+        # tiktoken with one encoder shared by every split. Each chunk keeps
+        # its page's source/page metadata plus its offset within the page
+        self.text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            model_name="text-embedding-ada-002",
+            chunk_size=512,
+            chunk_overlap=64,
+            separators=["\n\n", "\n", " ", ""],
+            add_start_index=True
         )
+        # Answers to earlier questions, reused for near-duplicate queries
+        self.semantic_cache = SemanticCache(threshold=0.95)
         os.makedirs(self.persist_directory, exist_ok=True)
         self.setup_chain()
         
     def load_documents(self):
         """Load and process documents from the documents directory"""
         documents = []
-        print(f"Scanning directory: {self.documents_dir}")
-        print(f"Directory exists: {os.path.exists(self.documents_dir)}")
-        print(f"Directory contents: {os.listdir(self.documents_dir)}")
+        # One directory read; DirEntry caches names, paths and file types
+        with os.scandir(self.documents_dir) as it:
+            entries = [entry for entry in it if entry.is_file()]
+        logger.debug("Directory contents of %s: %s", self.documents_dir, [entry.name for entry in entries])
         
-        for filename in os.listdir(self.documents_dir):
-            file_path = os.path.join(self.documents_dir, filename)
-            print(f"Processing file: {filename}")
-            print(f"Full file path: {file_path}")
-            print(f"File exists: {os.path.exists(file_path)}")
-            print(f"File size: {os.path.getsize(file_path)} bytes")
-            
-            try:
-                if filename.endswith('.pdf'):
-                    print(f"Loading PDF file: {filename}")
-                    try:
-                        # Verify PDF file header
-                        with open(file_path, 'rb') as f:
-                            header = f.read(4)
-                            if header != b'%PDF':
-                                print(f"Warning: {filename} does not appear to be a valid PDF file")
-                                continue
-                        
-                        # Use PDFMinerLoader with default settings
-                        loader = PDFMinerLoader(file_path)
-                        print("Created PDFMinerLoader")
-                        
-                        loaded_docs = loader.load()
-                        print(f"Loaded {len(loaded_docs)} pages")
-                        
-                        # Validate content
-                        valid_docs = []
-                        for doc in loaded_docs:
-                            if hasattr(doc, 'page_content') and doc.page_content.strip():
-                                valid_docs.append(doc)
-                                print(f"Found valid content in document: {len(doc.page_content)} characters")
-                                # Print first 100 characters to verify content
-                                print(f"Content preview: {doc.page_content[:100]}...")
-                        
-                        if valid_docs:
-                            print(f"Successfully loaded {len(valid_docs)} pages with content from {filename}")
-                            documents.extend(valid_docs)
-                        else:
-                            print(f"Warning: No valid content found in {filename}")
-                            
-                    except Exception as pdf_error:
-                        print(f"Error loading PDF {filename}: {str(pdf_error)}")
-                        print(f"PDF Exception type: {type(pdf_error)}")
-                        import traceback
-                        print(f"PDF Traceback: {traceback.format_exc()}")
-                        continue
-                else:
-                    print(f"Loading text file: {filename}")
-                    loader = TextLoader(file_path)
-                    loaded_docs = loader.load()
-                    print(f"Successfully loaded text from {filename}")
-                    documents.extend(loaded_docs)
-            except Exception as e:
-                print(f"Error loading {filename}: {str(e)}")
-                print(f"Exception type: {type(e)}")
-                import traceback
-                print(f"Traceback: {traceback.format_exc()}")
-                continue
+        paths = [entry.path for entry in entries]
+        for docs in map_files(_load_one, paths):
+            documents.extend(docs)
                 
-        print(f"Total documents loaded: {len(documents)}")
+        logger.info("Loaded %d documents from %d files", len(documents), len(paths))
         if not documents:
-            print("Warning: No documents were successfully loaded")
             raise ValueError("No documents could be loaded successfully")
         return documents
 
     def process_documents(self, documents):
         """Process documents into text chunks"""
-        all_texts = []
-        print(f"Processing {len(documents)} documents for text extraction")
-        for i, doc in enumerate(documents):
-            try:
-                if hasattr(doc, 'page_content'):
-                    text = doc.page_content
-                    print(f"Document {i+1}: Found page_content attribute")
-                else:
-                    text = str(doc)
-                    print(f"Document {i+1}: Converting to string")
-                
-                if not text.strip():
-                    print(f"Document {i+1}: Empty text content")
-                    continue
-                    
-                print(f"Document {i+1}: Splitting text of length {len(text)}")
-                chunks = self.text_splitter.split_text(text)
-                print(f"Document {i+1}: Created {len(chunks)} chunks")
-                # Convert chunks to Document objects
-                doc_chunks = [Document(page_content=chunk) for chunk in chunks]
-                all_texts.extend(doc_chunks)
-            except Exception as e:
-                print(f"Error processing document {i+1}: {str(e)}")
-                continue
-                
-        print(f"Total chunks created: {len(all_texts)}")
+        # Split everything in one call; metadata is carried onto each chunk
+        documents = [doc for doc in documents if doc.page_content.strip()]
+        all_texts = self.text_splitter.split_documents(documents)
+
+        logger.info("Split %d documents into %d chunks", len(documents), len(all_texts))
         if not all_texts:
-            print("Warning: No text content was extracted from documents")
             raise ValueError("No text content could be extracted from documents")
         return all_texts
 
+    def _load_and_split(self, file_path):
+        """Load a single file and split it into text chunks"""
+        return self.process_documents(_load_one(file_path))
+
+    def _ingest(self, texts):
+        """Add text chunks to the existing vector store"""
+        add_documents_in_batches(self.vectorstore, self.embeddings, texts)
+        self.vectorstore.persist()
+        # Cached answers may be stale now that the corpus has changed
+        self.semantic_cache.clear()
+        logger.info("Added %d chunks to vector store", len(texts))
+
     def create_vector_store(self, texts):
         """Create vector store from processed text chunks"""
         try:
             if not texts:
                 raise ValueError("No texts to process")
                 
-            # Create a unique collection name
-            collection_name = f"collection_{int(time.time())}"
-            
-            # Create vector store using Chroma with persistence
-            vector_store = Chroma.from_documents(
-                documents=texts,  # texts are now Document objects
-                embedding=self.embeddings,
-                collection_name=collection_name,
+            # Reuse one collection across runs; chunks are keyed by source and
+            # content hash, so only new chunks are embedded and added
+            vector_store = Chroma(
+                collection_name="documents",
+                embedding_function=self.embeddings,
                 persist_directory=self.persist_directory
             )
+            add_documents_in_batches(vector_store, self.embeddings, texts)
+
+            # Drop chunks from files that have since changed or been removed,
+            # and any stored under an older chunk id scheme
+            current_ids = {chunk_id(text) for text in texts}
+            stale_ids = [
+                doc_id
+                for doc_id in vector_store._collection.get(include=[])["ids"]
+                if doc_id not in current_ids
+            ]
+            if stale_ids:
+                vector_store._collection.delete(ids=stale_ids)
             
             # Persist the vector store
             vector_store.persist()
-            print(f"Vector store persisted to {self.persist_directory}")
+            logger.info("Vector store persisted to %s", self.persist_directory)
             
             return vector_store
-        except Exception as e:
-            print(f"Error creating vector store: {str(e)}")
+        except Exception:
+            logger.exception("Error creating vector store")
             raise
         
     def setup_chain(self):
@@ -166,58 +177,49 @@ class DocumentChatbot:
         try:
             documents = self.load_documents()
             if not documents:
-                print("No documents found")
+                logger.warning("No documents found")
                 return
             
-            print(f"Processing {len(documents)} documents...")
+            logger.info("Processing %d documents...", len(documents))
             texts = self.process_documents(documents)
             
             if not texts:
-                print("No text content extracted from documents")
+                logger.warning("No text content extracted from documents")
                 return
             
-            print(f"Creating vector store from {len(texts)} text chunks...")
+            logger.info("Creating vector store from %d text chunks...", len(texts))
             self.vectorstore = self.create_vector_store(texts)
             
-            openai_api_key = os.getenv("OPENAI_API_KEY")
-            if not openai_api_key:
-                raise ValueError("OPENAI_API_KEY not found in environment variables")
-            
-            # Initialize memory
-            self.memory = ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True,
-                output_key="answer"
-            )
-                
-            self.chain = ConversationalRetrievalChain.from_llm(
-                llm=ChatOpenAI(
-                    temperature=0,
-                    model_name="gpt-3.5-turbo",
-                    openai_api_key=openai_api_key
-                ),
-                retriever=self.vectorstore.as_retriever(
-                    search_kwargs={"k": 3}
-                ),
-                memory=self.memory,
-                return_source_documents=True,
-                output_key="answer"
+            # Memory, prompt and answering LLM all live in ChatChain; it
+            # shares our embeddings and semantic cache so each query is
+            # embedded once for both the cache and retrieval
+            self.chat_chain = ChatChain(
+                self.vectorstore.as_retriever(search_kwargs={"k": 3}),
+                embeddings=self.embeddings,
+                semantic_cache=self.semantic_cache
             )
-            print("Chat chain setup complete")
-        except Exception as e:
-            print(f"Error in setup_chain: {str(e)}")
+            logger.info("Chat chain setup complete")
+        except Exception:
+            logger.exception("Error in setup_chain")
             raise
         
     def chat(self, query: str) -> str:
         """Process a user query and return the response"""
-        if not hasattr(self, 'chain'):
+        if not hasattr(self, 'chat_chain'):
+            raise ValueError("Chat chain not initialized. Please upload some documents first.")
+        try:
+            return self.chat_chain.process_query(query)
+        except Exception:
+            logger.exception("Error in chat")
+            raise
+
+    async def astream_chat(self, query: str):
+        """Process a user query, yielding the answer token by token"""
+        if not hasattr(self, 'chat_chain'):
             raise ValueError("Chat chain not initialized. Please upload some documents first.")
         try:
-            result = self.chain({
-                "question": query,
-                "chat_history": self.memory.chat_memory.messages if hasattr(self, 'memory') else []
-            })
-            return result["answer"]
-        except Exception as e:
-            print(f"Error in chat: {str(e)}")
-            raise 
\ No newline at end of file
+            async for token in self.chat_chain.astream_query(query):
+                yield token
+        except Exception:
+            logger.exception("Error in chat")
+            raise
@@ -0,0 +1,62 @@
+import os
+import functools
+import httpx
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+# Load environment variables
+load_dotenv()
+
+# Connection pool limits shared by all OpenAI traffic in the process
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+
+
+def _openai_api_key():
+    openai_api_key = os.getenv("OPENAI_API_KEY")
+    if not openai_api_key:
+        raise ValueError("OPENAI_API_KEY not found in environment variables")
+    return openai_api_key
+
+
+@functools.lru_cache(maxsize=1)
+def get_http_client():
+    """
+    Shared HTTP/2 client so embeddings and chat requests reuse one warm
+    connection pool
+    """
+    return httpx.Client(http2=True, limits=HTTP_LIMITS)
+
+
+@functools.lru_cache(maxsize=1)
+def get_async_http_client():
+    """
+    Async counterpart of get_http_client, used by the chains' async paths
+    """
+    return httpx.AsyncClient(http2=True, limits=HTTP_LIMITS)
+
+
+@functools.lru_cache(maxsize=1)
+def get_embeddings():
+    """
+    Process-wide OpenAIEmbeddings instance
+    """
+    return OpenAIEmbeddings(
+        openai_api_key=_openai_api_key(),
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    )
+
+
+@functools.lru_cache(maxsize=2)
+def get_llm(streaming=False):
+    """
+    Process-wide ChatOpenAI instance, one per streaming mode
+    """
+    return ChatOpenAI(
+        model_name="gpt-3.5-turbo",
+        temperature=0,
+        openai_api_key=_openai_api_key(),
+        streaming=streaming,
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    )
@@ -1,12 +1,35 @@
-from sqlalchemy import create_engine, Column, String, Boolean, Integer, Float
+from sqlalchemy import create_engine, event, Column, String, Boolean, Integer, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"
 
+# A real pool so request threads each get their own connection instead of
+# sharing one; WAL (below) lets their reads run concurrently
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=QueuePool,
+    pool_size=10,
+    max_overflow=20,
+    pool_pre_ping=True,
 )
+
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside a writer, and NORMAL sync drops an
+    # fsync per commit; the rest keeps hot pages and temp data in memory
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -21,14 +44,23 @@ class DBUser(Base):
     disabled = Column(Boolean, default=False)
     failed_login_attempts = Column(Integer, default=0)
     last_failed_login = Column(Float, nullable=True)
-    refresh_token = Column(String, nullable=True)
-    reset_token = Column(String, nullable=True)
+    refresh_token = Column(String, nullable=True, index=True)
+    reset_token = Column(String, nullable=True, index=True)
     reset_token_expires = Column(Float, nullable=True)
 
 
 # Create all tables
 Base.metadata.create_all(bind=engine)
 
+# create_all skips tables that already exist, so add any indexes declared
+# since an existing database was created
+for index in DBUser.__table__.indexes:
+    index.create(bind=engine, checkfirst=True)
+
+# Close the connections opened above; with preload_app the gunicorn master
+# runs this import, and a pooled SQLite connection must not cross a fork
+engine.dispose()
+
 
 # Dependency
 def get_db():
@@ -1,7 +1,48 @@
+import hashlib
 import os
 import shutil
-from typing import List
+from typing import List, Union
 from .document_loaders import DocumentLoader
+from .parallel import map_files
+
+
+def _load_one(file_path: str) -> List:
+    """
+    Load a single document, returning no pages if it can't be loaded
+    """
+    filename = os.path.basename(file_path)
+    file_type = os.path.splitext(filename)[1].lower()
+
+    try:
+        return DocumentLoader.load_document(file_path, file_type)
+    except Exception as e:
+        print(f"Error loading {filename}: {str(e)}")
+        return []
+
+
+def _sha256(file_path: str) -> str:
+    """
+    Hex SHA-256 digest of a file, read in 1 MiB blocks
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _same_file_contents(src: str, dst: str) -> bool:
+    """
+    Whether dst already holds the contents of src. Matching size and mtime
+    (which copy2 preserves) settle it without reading either file; only
+    same-sized files with different mtimes are hashed
+    """
+    src_stat, dst_stat = os.stat(src), os.stat(dst)
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        return True
+    return _sha256(src) == _sha256(dst)
 
 
 class DocumentManager:
@@ -9,13 +50,17 @@ class DocumentManager:
         self.documents_dir = documents_dir
         os.makedirs(documents_dir, exist_ok=True)
 
-    def upload_document(self, file_path: str) -> bool:
+    def upload_document(self, file_path: str) -> Union[bool, str]:
         """
-        Upload a document to the documents directory
+        Upload a document to the documents directory. Returns "unchanged"
+        when an identical copy is already there, so callers can skip
+        re-embedding it
         """
         try:
             filename = os.path.basename(file_path)
             destination = os.path.join(self.documents_dir, filename)
+            if os.path.exists(destination) and _same_file_contents(file_path, destination):
+                return "unchanged"
             shutil.copy2(file_path, destination)
             return True
         except Exception as e:
@@ -27,15 +72,10 @@ class DocumentManager:
         Load all documents from the documents directory
         """
         documents = []
+        with os.scandir(self.documents_dir) as it:
+            paths = [entry.path for entry in it if entry.is_file()]
 
-        for filename in os.listdir(self.documents_dir):
-            file_path = os.path.join(self.documents_dir, filename)
-            file_type = os.path.splitext(filename)[1].lower()
-
-            try:
-                docs = DocumentLoader.load_document(file_path, file_type)
-                documents.extend(docs)
-            except Exception as e:
-                print(f"Error loading {filename}: {str(e)}")
+        for docs in map_files(_load_one, paths):
+            documents.extend(docs)
 
         return documents
@@ -0,0 +1,155 @@
+import fcntl
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+from pydantic import BaseModel
+
+# Uploaded documents and the index mapping document ids to them
+DOCUMENTS_DIR = "documents"
+DOCUMENTS_INDEX_PATH = "documents_index.json"
+DOCUMENTS_INDEX_LOCK_PATH = f"{DOCUMENTS_INDEX_PATH}.lock"
+
+
+# Document Models
+class Document(BaseModel):
+    id: str
+    filename: str
+    uploaded_at: datetime
+    user_id: str
+
+
+# Reconciled document index and the version of the saved file it was built
+# from. Replaced as one tuple, never changed in place, so concurrent readers
+# always see a complete index; only rebuilt when some worker saves the file
+_UNLOADED = object()
+_index_cache: tuple = (_UNLOADED, {})
+
+
+@contextmanager
+def documents_index_lock(exclusive: bool = False):
+    """
+    Hold a file lock on the document index; every gunicorn worker changes
+    it, so reads take a shared lock and read-modify-writes an exclusive one
+    """
+    with open(DOCUMENTS_INDEX_LOCK_PATH, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _index_file_version():
+    # Saves replace the file, so the inode changes even within one mtime tick
+    try:
+        st = os.stat(DOCUMENTS_INDEX_PATH)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_ino
+
+
+def _read_documents_index(version) -> dict[str, Document]:
+    """Read the saved index and reconcile it with the files on disk"""
+    saved = {}
+    if version is not None:
+        with open(DOCUMENTS_INDEX_PATH) as f:
+            for record in json.load(f):
+                doc = Document(**record)
+                saved[doc.id] = doc
+
+    if not os.path.exists(DOCUMENTS_DIR):
+        return {}
+
+    # Drop records for removed files and index files added outside the API
+    with os.scandir(DOCUMENTS_DIR) as it:
+        ctimes = {entry.name: entry.stat().st_ctime for entry in it if entry.is_file()}
+    filenames = set(ctimes)
+    index = {doc_id: doc for doc_id, doc in saved.items() if doc.filename in filenames}
+    known = {doc.filename for doc in index.values()}
+    for filename in filenames - known:
+        # Derived from the name so every worker gives the file the same id
+        doc = Document(
+            id=str(uuid.uuid5(uuid.NAMESPACE_URL, filename)),
+            filename=filename,
+            uploaded_at=datetime.fromtimestamp(ctimes[filename]),
+            user_id="",
+        )
+        index[doc.id] = doc
+    return index
+
+
+def load_documents_index() -> dict[str, Document]:
+    """
+    Current document index. The documents directory is only scanned on the
+    first call and after a worker saves the index; otherwise this is a
+    cached dict that callers must not modify. Callers hold
+    documents_index_lock
+    """
+    global _index_cache
+    version = _index_file_version()
+    cached_version, index = _index_cache
+    if cached_version is _UNLOADED or version != cached_version:
+        index = _read_documents_index(version)
+        _index_cache = (version, index)
+    return index
+
+
+def save_documents_index(index: dict[str, Document]):
+    """
+    Persist the document index so ids survive restarts and are shared by
+    all workers. Callers hold documents_index_lock(exclusive=True)
+    """
+    global _index_cache
+    records = [
+        {**doc.dict(), "uploaded_at": doc.uploaded_at.isoformat()}
+        for doc in index.values()
+    ]
+    tmp_path = f"{DOCUMENTS_INDEX_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(records, f)
+    os.replace(tmp_path, DOCUMENTS_INDEX_PATH)
+    _index_cache = (_index_file_version(), dict(index))
+
+
+def list_indexed_documents() -> list[Document]:
+    """Current document index, as saved by any worker"""
+    with documents_index_lock():
+        return list(load_documents_index().values())
+
+
+def index_document(filename: str, user_id: str):
+    """Record an uploaded file, replacing any earlier upload with the same name"""
+    with documents_index_lock(exclusive=True):
+        index = dict(load_documents_index())
+        for doc_id in [d.id for d in index.values() if d.filename == filename]:
+            del index[doc_id]
+        doc = Document(
+            id=str(uuid.uuid4()),
+            filename=filename,
+            uploaded_at=datetime.now(),
+            user_id=user_id,
+        )
+        index[doc.id] = doc
+        save_documents_index(index)
+
+
+def unindex_document(filename: str):
+    """Remove a file's record from the document index"""
+    with documents_index_lock(exclusive=True):
+        index = dict(load_documents_index())
+        for doc_id in [d.id for d in index.values() if d.filename == filename]:
+            del index[doc_id]
+        save_documents_index(index)
+
+
+def pop_indexed_document(document_id: str) -> Optional[Document]:
+    """Remove a document's record by id, returning it if it was indexed"""
+    with documents_index_lock(exclusive=True):
+        index = dict(load_documents_index())
+        doc = index.pop(document_id, None)
+        if doc is not None:
+            save_documents_index(index)
+        return doc
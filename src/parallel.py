@@ -0,0 +1,35 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Below this many files a process pool costs more to start than it saves
+MIN_FILES_FOR_PROCESSES = 3
+
+
+def _process_context():
+    # Never fork the caller: it may be a server with threads running (e.g.
+    # under asyncio.to_thread). A forkserver starts workers from a clean
+    # single-threaded process instead
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def map_files(load, paths):
+    """
+    Apply load to every path and return the results in order. Parsing is
+    CPU-bound, so several files are spread over worker processes; one or
+    two files are loaded in threads. load must be a module-level function
+    """
+    if not paths:
+        return []
+
+    max_workers = min(len(paths), os.cpu_count() or 1)
+    if len(paths) < MIN_FILES_FOR_PROCESSES:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=_process_context()
+        )
+    with executor:
+        return list(executor.map(load, paths))
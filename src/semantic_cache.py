@@ -0,0 +1,73 @@
+import threading
+import time
+import numpy as np
+
+
+class SemanticCache:
+    """
+    In-memory cache of answers keyed by the embedding of the query that
+    produced them. A lookup returns the answer for the most similar cached
+    query if its cosine similarity is above the threshold.
+    """
+
+    def __init__(self, threshold=0.95, max_size=4096):
+        self.threshold = threshold
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Drop every cached answer"""
+        with self._lock:
+            # Normalized query embeddings, one row per cached answer. Rows
+            # are preallocated up to max_size on the first put; only the
+            # first len(self.answers) rows are live
+            self.E = None
+            self.answers = []
+            self.expires_at = np.empty(self.max_size, dtype=np.float64)
+
+    def get(self, embedding):
+        """Return the cached answer for a similar query, or None"""
+        q = np.asarray(embedding, dtype=np.float32)
+        q = q / np.linalg.norm(q)
+        with self._lock:
+            self._drop_expired()
+            if not self.answers:
+                return None
+            scores = self.E[:len(self.answers)] @ q
+            i = int(scores.argmax())
+            return self.answers[i] if scores[i] > self.threshold else None
+
+    def put(self, embedding, answer, ttl=3600):
+        """Cache an answer for a query embedding for ttl seconds"""
+        v = np.asarray(embedding, dtype=np.float32)
+        v = v / np.linalg.norm(v)
+        with self._lock:
+            if self.E is None:
+                self.E = np.empty((self.max_size, len(v)), dtype=np.float32)
+            n = len(self.answers)
+            if n == self.max_size:
+                self._drop_expired()
+                n = len(self.answers)
+            if n == self.max_size:
+                # Evict the oldest eighth at once so a full cache compacts
+                # its rows once per max_size // 8 puts rather than every put
+                self._keep(np.arange(max(1, self.max_size // 8), n))
+                n = len(self.answers)
+            self.E[n] = v
+            self.answers.append(answer)
+            self.expires_at[n] = time.time() + ttl
+
+    def _drop_expired(self):
+        n = len(self.answers)
+        if n:
+            live = np.flatnonzero(self.expires_at[:n] > time.time())
+            if len(live) < n:
+                self._keep(live)
+
+    def _keep(self, rows):
+        """Compact the given rows, in order, to the front of the buffers"""
+        k = len(rows)
+        self.E[:k] = self.E[rows]
+        self.expires_at[:k] = self.expires_at[rows]
+        self.answers = [self.answers[i] for i in rows]
@@ -1,22 +1,106 @@
-import os
+import hashlib
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
 from langchain_community.vectorstores import Chroma
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from .clients import get_embeddings
 
 # Load environment variables
 load_dotenv()
 
+# Directory holding cached chunk embeddings
+EMBEDDING_CACHE_DIR = "./.emb_cache"
+# Number of query embeddings each DiskCachedEmbeddings keeps in memory
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+
+
+class DiskCachedEmbeddings(CacheBackedEmbeddings):
+    """
+    CacheBackedEmbeddings that also memoizes embed_query in a per-instance
+    LRU cache, so it is freed along with the instance
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+
+    def embed_query(self, text):
+        with self._query_cache_lock:
+            cached = self._query_cache.get(text)
+            if cached is not None:
+                self._query_cache.move_to_end(text)
+                return list(cached)
+
+        embedding = super().embed_query(text)
+
+        with self._query_cache_lock:
+            self._query_cache[text] = tuple(embedding)
+            if len(self._query_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return embedding
+
+
+def cached_embeddings(embeddings):
+    """
+    Wrap embeddings with a disk cache keyed by (model name, SHA-256 of the
+    chunk text)
+    """
+    return DiskCachedEmbeddings.from_bytes_store(
+        embeddings,
+        LocalFileStore(EMBEDDING_CACHE_DIR),
+        namespace=embeddings.model,
+        key_encoder="sha256",
+    )
+
+
+def chunk_id(doc):
+    """
+    Stable id for a chunk: the SHA-256 of its source and text, so files
+    that share a chunk each keep their own copy
+    """
+    key = f"{doc.metadata.get('source', '')}\0{doc.page_content}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def add_documents_in_batches(vector_store, embeddings, documents, batch_size=512):
+    """
+    Embed documents in batches and add them to a Chroma store under their
+    chunk ids, skipping chunks the store already holds
+    """
+    # Identical chunks of one file share an id, so keep only the first
+    unique_docs = {}
+    for doc in documents:
+        unique_docs.setdefault(chunk_id(doc), doc)
+
+    ids = list(unique_docs)
+    for start in range(0, len(ids), batch_size):
+        # Check existence per batch to keep each lookup query small
+        batch_ids = ids[start : start + batch_size]
+        existing = set(vector_store._collection.get(ids=batch_ids, include=[])["ids"])
+        batch_ids = [doc_id for doc_id in batch_ids if doc_id not in existing]
+        if not batch_ids:
+            continue
+        batch_docs = [unique_docs[doc_id] for doc_id in batch_ids]
+        contents = [doc.page_content for doc in batch_docs]
+        vector_store._collection.add(
+            ids=batch_ids,
+            embeddings=embeddings.embed_documents(contents),
+            documents=contents,
+            metadatas=[doc.metadata for doc in batch_docs],
+        )
+
 
 class VectorStore:
     def __init__(self, persist_directory="db"):
-        # Get API key from environment
-        openai_api_key = os.getenv("OPENAI_API_KEY")
-        if not openai_api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-
-        self.embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
+        self.embeddings = cached_embeddings(get_embeddings())
         self.persist_directory = persist_directory
+        self.text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            model_name="text-embedding-ada-002", chunk_size=512, chunk_overlap=64
+        )
 
     def create_vector_store(self, documents):
         """
@@ -25,13 +109,11 @@ class VectorStore:
         if not documents:
             raise ValueError("No documents provided")
 
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=200, length_function=len
-        )
-        splits = text_splitter.split_documents(documents)
+        splits = self.text_splitter.split_documents(documents)
 
-        return Chroma.from_documents(
-            documents=splits,
-            embedding=self.embeddings,
+        vector_store = Chroma(
+            embedding_function=self.embeddings,
             persist_directory=self.persist_directory,
         )
+        add_documents_in_batches(vector_store, self.embeddings, splits)
+        return vector_store
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from src.chat_chain import ChatChain
+from src.semantic_cache import SemanticCache
+
+
+class FakeMemory:
+    """Fails if the history is read while a save is in progress"""
+
+    def __init__(self):
+        self.turns = []
+        self.saving = False
+
+    def load_memory_variables(self, inputs):
+        assert not self.saving, "history read during a save"
+        return {"chat_history": list(self.turns)}
+
+    def save_context(self, inputs, outputs):
+        self.saving = True
+        time.sleep(0.02)
+        self.turns.append((inputs["question"], outputs["answer"]))
+        self.saving = False
+
+
+class FakeChain:
+    """Answering chain that records how many answers are generated at once"""
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.active = 0
+        self.peak = 0
+
+    def invoke(self, inputs):
+        assert not self.lock.locked(), "memory lock held while answering"
+        time.sleep(0.02)
+        return SimpleNamespace(content=f"answer to {inputs['question']}")
+
+    async def astream(self, inputs):
+        assert not self.lock.locked(), "memory lock held while streaming"
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            for token in ("a", "b", "c"):
+                await asyncio.sleep(0.01)
+                yield SimpleNamespace(content=token)
+        finally:
+            self.active -= 1
+
+
+class FakeCondenseChain:
+    def invoke(self, inputs):
+        return SimpleNamespace(content=f"standalone {inputs['question']}")
+
+    async def ainvoke(self, inputs):
+        return self.invoke(inputs)
+
+
+def _chat_chain(embeddings=None):
+    chain = object.__new__(ChatChain)
+    chain.memory = FakeMemory()
+    chain._memory_lock = threading.Lock()
+    chain.chain = FakeChain(chain._memory_lock)
+    chain.condense_chain = FakeCondenseChain()
+    chain.embeddings = embeddings
+    chain.semantic_cache = SemanticCache(threshold=0.95)
+    chain.retrieved = []
+
+    def retrieve(query, query_embedding=None):
+        chain.retrieved.append(query)
+        return "context"
+
+    chain._retrieve = retrieve
+    return chain
+
+
+async def _collect(chain, query):
+    return "".join([token async for token in chain.astream_query(query)])
+
+
+def test_streams_are_generated_concurrently():
+    chain = _chat_chain()
+
+    async def main():
+        return await asyncio.gather(
+            *(_collect(chain, f"q{i}") for i in range(4)),
+            asyncio.to_thread(chain.process_query, "sync"),
+        )
+
+    answers = asyncio.run(main())
+
+    assert answers[:4] == ["abc"] * 4
+    assert chain.chain.peak > 1
+    assert len(chain.memory.turns) == 5
+
+
+def test_cancelled_stream_releases_memory_lock():
+    chain = _chat_chain()
+
+    async def main():
+        stream = chain.astream_query("q")
+        await stream.__anext__()
+        await stream.aclose()
+
+    asyncio.run(main())
+
+    assert not chain._memory_lock.locked()
+    assert chain.memory.turns == []
+
+
+def test_follow_up_is_condensed_before_retrieval():
+    chain = _chat_chain()
+    chain.process_query("first")
+    chain.process_query("and the second one?")
+
+    assert chain.retrieved == ["first", "standalone and the second one?"]
+
+
+def test_semantic_cache_hit_skips_answering():
+    embeddings = SimpleNamespace(embed_query=lambda text: [1.0, 0.0])
+    chain = _chat_chain(embeddings)
+    chain.semantic_cache.put([1.0, 0.0], "cached")
+
+    assert chain.process_query("q") == "cached"
+    assert chain.retrieved == []
+    assert chain.memory.turns == [("q", "cached")]
@@ -0,0 +1,103 @@
+import importlib.util
+import json
+import os
+
+import pytest
+
+from src import documents_index
+
+
+def _worker():
+    """A separate copy of the module, standing in for another gunicorn worker"""
+    spec = importlib.util.spec_from_file_location(
+        "documents_index_worker", documents_index.__file__
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(documents_index.DOCUMENTS_DIR)
+    monkeypatch.setattr(
+        documents_index, "_index_cache", (documents_index._UNLOADED, {})
+    )
+    return tmp_path
+
+
+def _touch(filename):
+    with open(os.path.join(documents_index.DOCUMENTS_DIR, filename), "w") as f:
+        f.write("x")
+
+
+def test_index_document_is_saved(workdir):
+    _touch("a.txt")
+    documents_index.index_document("a.txt", "alice")
+
+    with open(documents_index.DOCUMENTS_INDEX_PATH) as f:
+        records = json.load(f)
+    assert [(r["filename"], r["user_id"]) for r in records] == [("a.txt", "alice")]
+
+
+def test_reupload_replaces_record(workdir):
+    _touch("a.txt")
+    documents_index.index_document("a.txt", "alice")
+    documents_index.index_document("a.txt", "bob")
+
+    docs = documents_index.list_indexed_documents()
+    assert [(d.filename, d.user_id) for d in docs] == [("a.txt", "bob")]
+
+
+def test_changes_are_visible_to_other_workers(workdir):
+    other = _worker()
+    _touch("a.txt")
+    documents_index.index_document("a.txt", "alice")
+    assert [d.filename for d in other.list_indexed_documents()] == ["a.txt"]
+
+    # A save in the other worker must keep this worker's record
+    _touch("b.txt")
+    other.index_document("b.txt", "bob")
+    assert sorted(d.filename for d in documents_index.list_indexed_documents()) == [
+        "a.txt",
+        "b.txt",
+    ]
+
+    doc_id = next(
+        d.id for d in documents_index.list_indexed_documents() if d.filename == "a.txt"
+    )
+    assert other.pop_indexed_document(doc_id).filename == "a.txt"
+    os.remove(os.path.join(documents_index.DOCUMENTS_DIR, "a.txt"))
+    assert [d.filename for d in documents_index.list_indexed_documents()] == ["b.txt"]
+
+
+def test_files_added_outside_the_api_get_the_same_id_in_every_worker(workdir):
+    _touch("external.txt")
+    ids = [d.id for d in documents_index.list_indexed_documents()]
+    assert ids == [d.id for d in _worker().list_indexed_documents()]
+    assert [d.user_id for d in documents_index.list_indexed_documents()] == [""]
+
+
+def test_records_for_removed_files_are_dropped(workdir):
+    _touch("a.txt")
+    documents_index.index_document("a.txt", "alice")
+    os.remove(os.path.join(documents_index.DOCUMENTS_DIR, "a.txt"))
+
+    assert _worker().list_indexed_documents() == []
+
+
+def test_pop_unknown_document_returns_none(workdir):
+    assert documents_index.pop_indexed_document("missing") is None
+
+
+def test_listing_is_served_from_cache(workdir, monkeypatch):
+    _touch("a.txt")
+    documents_index.index_document("a.txt", "alice")
+    documents_index.list_indexed_documents()
+
+    def scandir(path):
+        raise AssertionError("documents directory scanned again")
+
+    monkeypatch.setattr(documents_index.os, "scandir", scandir)
+    assert [d.filename for d in documents_index.list_indexed_documents()] == ["a.txt"]
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from src import semantic_cache
+from src.semantic_cache import SemanticCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache.time, "time", lambda: now[0])
+    return now
+
+
+def _vec(i, dim=8):
+    v = np.zeros(dim, dtype=np.float32)
+    v[i % dim] = 1.0
+    v[(i // dim) % dim] += 0.5
+    return v
+
+
+def test_empty_cache_misses():
+    assert SemanticCache().get(_vec(0)) is None
+
+
+def test_similar_query_hits_and_dissimilar_misses():
+    cache = SemanticCache(threshold=0.95)
+    cache.put([1.0, 0.0, 0.0], "answer")
+
+    assert cache.get([2.0, 0.01, 0.0]) == "answer"
+    assert cache.get([1.0, 1.0, 0.0]) is None
+
+
+def test_returns_most_similar_answer():
+    cache = SemanticCache(threshold=0.5)
+    cache.put([1.0, 0.0], "x")
+    cache.put([0.0, 1.0], "y")
+
+    assert cache.get([0.1, 1.0]) == "y"
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = SemanticCache()
+    cache.put(_vec(0), "short", ttl=10)
+    cache.put(_vec(1), "long", ttl=100)
+
+    clock[0] += 50
+    assert cache.get(_vec(0)) is None
+    assert cache.get(_vec(1)) == "long"
+    assert cache.answers == ["long"]
+
+
+def test_full_cache_evicts_oldest_eighth(clock):
+    cache = SemanticCache(threshold=0.99, max_size=16)
+    for i in range(17):
+        cache.put(_vec(i), i)
+
+    assert cache.answers == list(range(2, 17))
+    assert cache.get(_vec(0)) is None
+    assert cache.get(_vec(16)) == 16
+
+
+def test_full_cache_drops_expired_entries_before_evicting(clock):
+    cache = SemanticCache(threshold=0.99, max_size=16)
+    cache.put(_vec(0), 0, ttl=1)
+    for i in range(1, 16):
+        cache.put(_vec(i), i, ttl=100)
+
+    clock[0] += 10
+    cache.put(_vec(16), 16)
+    assert cache.answers == list(range(1, 17))
+
+
+def test_clear_drops_everything():
+    cache = SemanticCache()
+    cache.put(_vec(0), "answer")
+    cache.clear()
+
+    assert cache.get(_vec(0)) is None
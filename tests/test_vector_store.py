@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+from langchain.schema import Document
+
+from src import chatbot as chatbot_module
+from src.vector_store import add_documents_in_batches, chunk_id
+
+
+class FakeCollection:
+    """The subset of a Chroma collection add_documents_in_batches uses"""
+
+    def __init__(self):
+        self.records = {}
+        self.get_calls = []
+
+    def get(self, ids=None, include=None):
+        self.get_calls.append(ids)
+        if ids is None:
+            return {"ids": list(self.records)}
+        return {"ids": [doc_id for doc_id in ids if doc_id in self.records]}
+
+    def add(self, ids, embeddings, documents, metadatas):
+        for doc_id, document, metadata in zip(ids, documents, metadatas):
+            self.records[doc_id] = (document, metadata)
+
+    def delete(self, ids):
+        for doc_id in ids:
+            del self.records[doc_id]
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [[float(len(text))] for text in texts]
+
+
+def _store():
+    return SimpleNamespace(_collection=FakeCollection(), persist=lambda: None)
+
+
+def _doc(text, source):
+    return Document(page_content=text, metadata={"source": source})
+
+
+def test_chunk_id_depends_on_source_and_text():
+    assert chunk_id(_doc("same", "a.txt")) == chunk_id(_doc("same", "a.txt"))
+    assert chunk_id(_doc("same", "a.txt")) != chunk_id(_doc("same", "b.txt"))
+    assert chunk_id(_doc("one", "a.txt")) != chunk_id(_doc("two", "a.txt"))
+
+
+def test_shared_chunks_are_kept_per_source():
+    store, embeddings = _store(), FakeEmbeddings()
+    docs = [_doc("shared", "a.txt"), _doc("shared", "b.txt"), _doc("shared", "a.txt")]
+
+    add_documents_in_batches(store, embeddings, docs)
+
+    sources = sorted(meta["source"] for _, meta in store._collection.records.values())
+    assert sources == ["a.txt", "b.txt"]
+    assert embeddings.embedded == ["shared", "shared"]
+
+
+def test_existing_chunks_are_not_embedded_again():
+    store, embeddings = _store(), FakeEmbeddings()
+    add_documents_in_batches(store, embeddings, [_doc("one", "a.txt")])
+
+    add_documents_in_batches(store, embeddings, [_doc("one", "a.txt"), _doc("two", "a.txt")])
+
+    assert embeddings.embedded == ["one", "two"]
+    assert len(store._collection.records) == 2
+
+
+def test_existence_is_checked_per_batch():
+    store, embeddings = _store(), FakeEmbeddings()
+    docs = [_doc(f"chunk {i}", "a.txt") for i in range(5)]
+
+    add_documents_in_batches(store, embeddings, docs, batch_size=2)
+
+    assert [len(ids) for ids in store._collection.get_calls] == [2, 2, 1]
+    assert len(store._collection.records) == 5
+
+
+def test_create_vector_store_drops_stale_chunks(monkeypatch, tmp_path):
+    store, embeddings = _store(), FakeEmbeddings()
+    stale = _doc("removed", "gone.txt")
+    add_documents_in_batches(store, embeddings, [stale, _doc("kept", "a.txt")])
+    monkeypatch.setattr(chatbot_module, "Chroma", lambda **kwargs: store)
+
+    bot = object.__new__(chatbot_module.DocumentChatbot)
+    bot.embeddings = embeddings
+    bot.persist_directory = str(tmp_path)
+    texts = [_doc("kept", "a.txt"), _doc("new", "b.txt")]
+    assert bot.create_vector_store(texts) is store
+
+    assert set(store._collection.records) == {chunk_id(doc) for doc in texts}
+    assert chunk_id(stale) not in store._collection.records